@@ -1,15 +1,29 @@
- """
+"""
 Audio Sound Effects Management Module
 Reusable audio system for other modules
 """
 
 import os
+import sys
+import collections
+import tempfile
 import threading
+from concurrent.futures import ThreadPoolExecutor
 import sounddevice as sd
 import soundfile as sf
 import numpy as np
 import logging
-from pathlib import Path
+
+
+def _aligned_empty(shape, dtype, align=64):
+    """Return an uninitialized C-contiguous array starting on an `align`-byte boundary"""
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    raw = np.empty(nbytes + align, dtype=np.uint8)
+    offset = -raw.ctypes.data % align
+    arr = raw[offset:offset + nbytes].view(dtype).reshape(shape)
+    assert arr.ctypes.data % align == 0
+    return arr
 
 
 class AudioManager:
@@ -17,9 +31,41 @@ class AudioManager:
     
     def __init__(self, sounds_dir="src/sounds"):
         self.sounds_dir = sounds_dir
+        # Copy-on-write: writers swap in a new dict, readers never lock
         self.audio_cache = {}
+        self._writer_lock = threading.Lock()
         self._initialized = False
         
+        # Every cached clip is resampled to this rate at load time
+        self._target_fs = 48000
+        
+        # Clips at least this long are decoded once to disk and memory-mapped
+        self._mmap_min_frames = 10 * self._target_fs
+        self._decoded_cache_dirname = '_pcm_cache'
+        
+        # Persistent output stream (opened once, fed via blocking writes)
+        self._stream = None
+        # Concurrent clips are mixed and written one block at a time
+        self._mix_block_frames = 2048
+        self._max_voices = 8
+        # Incremented by stop_all_sounds to cancel pending/in-progress writes
+        self._stop_generation = 0
+        
+        # Pending (sound_key, data, generation) requests. deque.append/popleft are
+        # atomic, so any number of producers can enqueue without a mutex; the
+        # only lock involved is the Event's, used to wake an idle worker.
+        self._play_q = collections.deque()
+        self._play_q_max = 64
+        self._play_event = threading.Event()
+        
+        # Single long-lived playback worker draining the queue
+        self._playback_thread = threading.Thread(
+            target=self._playback_loop,
+            daemon=True,
+            name="AudioPlayback"
+        )
+        self._playback_thread.start()
+        
         # Default audio file mapping
         self.default_sounds = {
             'AP_Engage': 'AP_Engage.mp3',
@@ -31,6 +77,13 @@ class AudioManager:
             'chime_hi_lo': 'chime_hi_lo.mp3'
         }
         
+        # Resource base path (PyInstaller bundle or development directory)
+        self._base_path = getattr(sys, '_MEIPASS', None) or os.path.abspath(".")
+        self._resolved_paths = {
+            sound_key: self._get_resource_path(os.path.join(self.sounds_dir, filename))
+            for sound_key, filename in self.default_sounds.items()
+        }
+        
         self.initialize()
     
     def initialize(self):
@@ -48,12 +101,30 @@ class AudioManager:
             # More flexible latency settings for reliability
             sd.default.latency = ['low', 'high']  # try low latency, fallback to high latency
             
-            # Preload audio files
-            self._preload_audio_files()
+            # Preload audio files in the background while PortAudio starts up
+            preload_thread = threading.Thread(
+                target=self._preload_audio_files,
+                daemon=True,
+                name="AudioPreload"
+            )
+            preload_thread.start()
+            
+            # Open the persistent output stream at the target sample rate
+            self._open_output_stream()
             
             # Warm up sounddevice stream (reduce first-play latency)
             self._warmup_audio_stream()
             
+            # Compile the mixer kernels before the first real play
+            try:
+                # Imported here so importing this module stays cheap (Numba is heavy)
+                from audio_manager_mix import warmup_mixer
+                warmup_mixer(self._mix_block_frames)
+            except Exception as e:
+                logging.warning(f"Mixer warm-up failed: {e}")
+            
+            preload_thread.join()
+            
             self._initialized = True
             print("Audio system initialization complete")
             
@@ -63,47 +134,172 @@ class AudioManager:
     
     def _warmup_audio_stream(self):
         """Warm up the audio stream to eliminate first-play latency"""
+        if self._stream is None:
+            return
+        
         try:
-            # Play a very short silence to initialize the stream
-            silence = np.zeros((100,), dtype=np.float32)  # 100-sample silence
-            sd.play(silence, 22050, blocksize=2048)
-            sd.wait()  # wait until done
+            self._stream.start()
             print("Audio stream warm-up complete")
+            # Prime the device buffer with one block of silence; returns without waiting
+            silence = np.zeros((self._stream.blocksize, 2), dtype=np.int16)
+            self._stream.write(silence)
         except Exception as e:
             logging.warning(f"Audio stream warm-up failed: {e}")
     
+    def _open_output_stream(self):
+        """Open a long-lived output stream shared by all playback"""
+        try:
+            self._stream = sd.OutputStream(
+                samplerate=self._target_fs,
+                channels=2,
+                dtype='int16',
+                blocksize=2048,
+                latency='high'
+            )
+        except Exception as e:
+            self._stream = None
+            logging.warning(f"Failed to open persistent output stream: {e}")
+    
     def _get_resource_path(self, relative_path):
         """Return resource file path (compatible with PyInstaller)"""
+        return os.path.join(self._base_path, relative_path)
+    
+    def _resample(self, data, fs):
+        """Resample decoded audio to the target sample rate"""
+        if fs == self._target_fs:
+            return data
+        # Imported on demand; scipy is slow to import and rarely needed
+        from scipy.signal import resample_poly
+        return resample_poly(data, self._target_fs, fs, axis=0).astype(np.float32)
+    
+    def _to_stereo(self, data):
+        """Return audio as a C-contiguous float32 stereo array"""
+        if data.ndim == 1:
+            # Convert mono to stereo in a single typed copy
+            data = np.ascontiguousarray(
+                np.broadcast_to(data[:, None], (data.shape[0], 2)), dtype=np.float32
+            )
+        else:
+            data = np.ascontiguousarray(data, dtype=np.float32)
+        
+        assert data.flags['C_CONTIGUOUS']
+        return data
+    
+    def _quantize(self, data):
+        """Convert float32 audio to int16, attenuating it first if it would clip"""
+        peak = float(np.max(np.abs(data))) if data.size else 0.0
+        if peak > 1.0:
+            # e.g. resampling overshoot on near-full-scale material
+            logging.info(f"Audio peak {peak:.2f} exceeds full scale; attenuating by 1/{peak:.2f}")
+            data = data / np.float32(peak)
+        # Cache-line aligned so copies into the driver buffer stream cleanly
+        quantized = _aligned_empty(data.shape, np.int16)
+        np.copyto(quantized, np.clip(data * 32767, -32768, 32767), casting='unsafe')
+        return quantized
+    
+    def _get_decoded_cache_path(self, resolved_path):
+        """Return the path of the decoded int16 PCM mirror for an audio file"""
+        directory, filename = os.path.split(resolved_path)
+        name = f"{os.path.splitext(filename)[0]}.{self._target_fs}.i16"
+        return os.path.join(directory, self._decoded_cache_dirname, name)
+    
+    def _list_decoded_mirrors(self, directory):
+        """Return the names of decoded PCM mirrors kept for files in `directory`"""
+        try:
+            with os.scandir(os.path.join(directory, self._decoded_cache_dirname)) as entries:
+                return {entry.name for entry in entries}
+        except OSError:
+            return set()  # no mirror directory yet
+    
+    def _load_audio(self, resolved_path, mirrors=None):
+        """Decode an audio file into an int16 stereo array at the target rate
+        
+        Long clips are stored as raw PCM next to the source file and returned
+        as a read-only memmap, so their pages are only brought in while they
+        are played. `mirrors` is the set of mirror names already present for
+        the file's directory (listed on demand when not given).
+        """
+        if mirrors is None:
+            mirrors = self._list_decoded_mirrors(os.path.dirname(resolved_path))
+        
+        cache_path = self._get_decoded_cache_path(resolved_path)
+        if os.path.basename(cache_path) in mirrors:
+            try:
+                if os.path.getmtime(cache_path) >= os.path.getmtime(resolved_path):
+                    return np.memmap(cache_path, dtype=np.int16, mode='r').reshape(-1, 2)
+            except (OSError, ValueError):
+                pass  # missing, empty or truncated mirror; decode from source
+        
+        data, fs = sf.read(resolved_path, dtype='float32', always_2d=False)
+        data = self._quantize(self._to_stereo(self._resample(data, fs)))
+        if data.shape[0] < self._mmap_min_frames:
+            return data
+        
+        tmp_path = None
         try:
-            # When built with PyInstaller
-            import sys
-            base_path = sys._MEIPASS
-        except Exception:
-            # Development environment
-            base_path = os.path.abspath(".")
+            cache_dir = os.path.dirname(cache_path)
+            os.makedirs(cache_dir, exist_ok=True)
+            # Unique per writer, so concurrent threads/processes never share a temp file
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                data.tofile(f)
+            os.replace(tmp_path, cache_path)
+            return np.memmap(cache_path, dtype=data.dtype, mode='r', shape=data.shape)
+        except OSError as e:
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+            # e.g. read-only install directory; keep the clip in memory
+            logging.debug(f"Could not write decoded audio cache (ignored): {e}")
+            return data
+    
+    def _is_missing_file(self, error, resolved_path):
+        """Return True if a load error means the audio file does not exist"""
+        if isinstance(error, FileNotFoundError):
+            return True
+        # libsndfile reports a missing file as a generic open error; only on
+        # this failure path is it worth a stat to tell the two apart
+        return isinstance(error, sf.SoundFileError) and not os.path.exists(resolved_path)
+    
+    def _load_one(self, pair, mirrors=None):
+        """Decode one audio file; return (sound_key, data) or None"""
+        sound_key, resolved_path = pair
+        try:
+            return sound_key, self._load_audio(resolved_path, mirrors)
         
-        return os.path.join(base_path, relative_path)
+        except Exception as e:
+            if self._is_missing_file(e, resolved_path):
+                logging.warning(f"Audio file not found: {resolved_path}")
+                return None
+            logging.error(f"Error loading audio file ({sound_key}): {e}")
+            return None
     
     def _preload_audio_files(self):
         """Preload audio files into memory"""
         try:
             # Load default sound files
-            for sound_key, filename in self.default_sounds.items():
-                file_path = os.path.join(self.sounds_dir, filename)
-                resolved_path = self._get_resource_path(file_path)
-                
-                if os.path.exists(resolved_path):
-                    data, fs = sf.read(resolved_path)
-                    # Convert mono to stereo
-                    if len(data.shape) == 1:
-                        data = np.column_stack((data, data))
-                    
-                    self.audio_cache[sound_key] = {
-                        'data': data,
-                        'fs': fs
-                    }
-                else:
-                    logging.warning(f"Audio file not found: {resolved_path}")
+            pairs = list(self._resolved_paths.items())
+            
+            # List each mirror directory once instead of probing per file
+            directories = {os.path.dirname(path) for _, path in pairs}
+            mirrors = {directory: self._list_decoded_mirrors(directory) for directory in directories}
+            
+            # libsndfile releases the GIL while decoding, so files decode in parallel
+            max_workers = min(8, os.cpu_count() or 1)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(
+                    lambda pair: self._load_one(pair, mirrors[os.path.dirname(pair[1])]),
+                    pairs
+                ))
+            
+            # Populate the cache only after all workers finish
+            with self._writer_lock:
+                new_cache = dict(self.audio_cache)
+                new_cache.update(result for result in results if result is not None)
+                self.audio_cache = new_cache
             
             print(f"Loaded {len(self.audio_cache)} audio files")
             
@@ -113,67 +309,145 @@ class AudioManager:
     
     def add_sound(self, sound_key, file_path):
         """Add a new sound file"""
+        resolved_path = self._get_resource_path(file_path)
         try:
-            resolved_path = self._get_resource_path(file_path)
-            if not os.path.exists(resolved_path):
-                logging.error(f"Audio file not found: {resolved_path}")
-                return False
-                
-            data, fs = sf.read(resolved_path)
+            data = self._load_audio(resolved_path)
             
-            # Convert mono to stereo
-            if len(data.shape) == 1:
-                data = np.column_stack((data, data))
-            
-            self.audio_cache[sound_key] = {
-                'data': data,
-                'fs': fs
-            }
+            with self._writer_lock:
+                self.audio_cache = {**self.audio_cache, sound_key: data}
             
             logging.info(f"Sound added: {sound_key}")
             return True
             
         except Exception as e:
+            if self._is_missing_file(e, resolved_path):
+                logging.error(f"Audio file not found: {resolved_path}")
+                return False
             logging.error(f"Error adding sound ({sound_key}): {e}")
             return False
     
-    def play_sound(self, sound_key):
-        """Play sound (non-blocking asynchronous playback)"""
-        if sound_key not in self.audio_cache:
-            logging.warning(f"Sound key not found: {sound_key}")
-            return False
+    def _boost_playback_thread_priority(self):
+        """Raise the calling thread's scheduling priority on Windows (once per thread)"""
+        try:
+            import ctypes
+        except Exception as e:
+            logging.debug(f"ctypes unavailable, thread priority unchanged (ignored): {e}")
+            return
         
-        def _play_thread():
-            try:
-                # Set Windows thread priority for stable playback under CPU load
+        # Opt into MMCSS "Pro Audio" scheduling (Windows Vista+)
+        try:
+            task_index = ctypes.c_ulong(0)
+            if not ctypes.windll.avrt.AvSetMmThreadCharacteristicsW("Pro Audio", ctypes.byref(task_index)):
+                logging.debug("MMCSS registration failed (ignored)")
+        except Exception as e:
+            logging.debug(f"Failed to register thread with MMCSS (ignored): {e}")
+        
+        # Set Windows thread priority for stable playback under CPU load
+        try:
+            ctypes.windll.kernel32.SetThreadPriority(
+                ctypes.windll.kernel32.GetCurrentThread(), 15  # THREAD_PRIORITY_TIME_CRITICAL
+            )
+        except Exception as e:
+            logging.debug(f"Failed to set Windows thread priority (ignored): {e}")
+    
+    def _playback_loop(self):
+        """Play queued sounds one after another on the persistent stream"""
+        self._boost_playback_thread_priority()
+        
+        # Imported on the worker (only created with the manager) to keep module import cheap
+        try:
+            from audio_manager_mix import mix_block
+        except Exception as e:
+            # Never let the worker die at startup; play clips unmixed instead
+            logging.error(f"Failed to load audio mixer, falling back to sd.play: {e}")
+            mix_block = None
+        
+        out = np.zeros((self._mix_block_frames, 2), dtype=np.int16)
+        acc = np.zeros((self._mix_block_frames, 2), dtype=np.float32)
+        voices = []
+        voices_generation = self._stop_generation
+        
+        while True:
+            if not voices:
+                # Clear before re-checking so a concurrent set() is never lost
+                self._play_event.clear()
+                if not self._play_q:
+                    self._play_event.wait()
+            
+            # Drop everything that was playing when stop_all_sounds was called
+            if voices_generation != self._stop_generation:
+                voices = []
+                voices_generation = self._stop_generation
+            
+            while self._play_q:
+                entry = self._play_q.popleft()
                 try:
-                    import ctypes
-                    ctypes.windll.kernel32.SetThreadPriority(
-                        ctypes.windll.kernel32.GetCurrentThread(), 2  # THREAD_PRIORITY_ABOVE_NORMAL
-                    )
+                    sound_key, data, generation = entry
+                    if generation != self._stop_generation:
+                        continue
+                    if self._stream is None or mix_block is None:
+                        # Fallback when the persistent stream or mixer is unavailable
+                        self._play_fallback(sound_key, data)
+                    elif len(voices) >= self._max_voices:
+                        logging.warning(f"Too many concurrent sounds, dropping: {sound_key}")
+                    else:
+                        voices.append([data, 0])
                 except Exception as e:
-                    logging.debug(f"Failed to set Windows thread priority (ignored): {e}")
-                
-                audio = self.audio_cache[sound_key]
-                # Use larger blocksize to prevent dropouts
-                sd.play(audio['data'], audio['fs'], blocksize=2048)
+                    logging.error(f"Error queuing audio for playback: {e}")
             
+            if not voices:
+                continue
+            
+            try:
+                frames, voices = mix_block(out, acc, voices)
+                # stop_all_sounds may have run while mixing; don't play a stale block
+                if voices_generation != self._stop_generation:
+                    voices = []
+                    continue
+                # write() blocks inside PortAudio without holding the GIL
+                self._stream.write(out[:frames])
             except Exception as e:
-                logging.error(f"Error playing audio ({sound_key}): {e}")
+                if voices_generation == self._stop_generation:
+                    logging.error(f"Error playing audio: {e}")
+                voices = []
+    
+    def _play_fallback(self, sound_key, data):
+        """Play a clip with sd.play when the persistent stream or mixer is unavailable"""
+        try:
+            sd.play(data, self._target_fs, blocksize=2048)
+        except Exception as e:
+            logging.error(f"Error playing audio ({sound_key}): {e}")
+    
+    def play_sound(self, sound_key):
+        """Play sound (non-blocking asynchronous playback)
         
-        # Run playback in a high-priority daemon thread
-        thread = threading.Thread(
-            target=_play_thread, 
-            daemon=True, 
-            name=f"AudioPlay_{sound_key}"
-        )
-        thread.start()
+        Safe to call from any thread. Enqueueing takes no mutex; waking the
+        worker goes through threading.Event.set(), which locks briefly.
+        """
+        cache = self.audio_cache
+        data = cache.get(sound_key)
+        if data is None:
+            logging.warning(f"Sound key not found: {sound_key}")
+            return False
+        
+        # Soft bound: concurrent producers may overshoot it by a few entries
+        if len(self._play_q) >= self._play_q_max:
+            logging.warning(f"Playback queue full, dropping sound: {sound_key}")
+            return False
+        
+        self._play_q.append((sound_key, data, self._stop_generation))
+        self._play_event.set()
         return True
     
     def get_audio_data(self, sound_key):
-        """Return audio data for voice synthesis"""
-        if sound_key in self.audio_cache:
-            return self.audio_cache[sound_key]
+        """Return audio data for voice synthesis (float32 stereo)"""
+        cache = self.audio_cache
+        if sound_key in cache:
+            data = cache[sound_key].astype(np.float32) / 32767
+            return {
+                'data': data,
+                'fs': self._target_fs
+            }
         else:
             logging.warning(f"Sound key not found: {sound_key}")
             return None
@@ -185,17 +459,32 @@ class AudioManager:
     def stop_all_sounds(self):
         """Stop all sound playback"""
         try:
+            self._stop_generation += 1
+            if self._stream is not None:
+                # abort() discards buffered audio and unblocks any pending write()
+                self._stream.abort()
+                self._stream.start()
             sd.stop()
         except Exception as e:
             logging.error(f"Error stopping audio: {e}")
 
-# Global instance (eager initialization for performance)
-_audio_manager_instance = AudioManager()
+# Global instance (created lazily on first use)
+_audio_manager_instance = None
+_init_lock = threading.Lock()
 
 def get_audio_manager():
-    """Return the singleton AudioManager instance"""
+    """Return the singleton AudioManager instance, creating it on first call"""
+    global _audio_manager_instance
+    if _audio_manager_instance is None:
+        with _init_lock:
+            if _audio_manager_instance is None:
+                _audio_manager_instance = AudioManager()
     return _audio_manager_instance
 
+def prewarm():
+    """Eagerly initialize the audio system (e.g. from startup scripts)"""
+    get_audio_manager()
+
 def play_sound(sound_key):
     """Convenience function to play sound"""
     return get_audio_manager().play_sound(sound_key)
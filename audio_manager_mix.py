@@ -0,0 +1,94 @@
+"""
+Audio Block Mixer
+Sums concurrently playing clips into int16 output blocks for AudioManager
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    # Numba is optional; fall back to vectorized NumPy kernels
+    njit = None
+
+
+def _accumulate_loop(acc, src, start, count):
+    """Add `count` int16 stereo frames of `src` (from `start`) to `acc`"""
+    for i in range(count):
+        acc[i, 0] += src[start + i, 0]
+        acc[i, 1] += src[start + i, 1]
+
+
+def _saturate_loop(acc, out, count):
+    """Convert the first `count` accumulated frames to int16 with clipping"""
+    for i in range(count):
+        for c in range(2):
+            v = acc[i, c]
+            if v > 32767.0:
+                v = 32767.0
+            elif v < -32768.0:
+                v = -32768.0
+            out[i, c] = np.int16(v)
+
+
+def _accumulate_numpy(acc, src, start, count):
+    """NumPy version of _accumulate_loop"""
+    acc[:count] += src[start:start + count]
+
+
+def _saturate_numpy(acc, out, count):
+    """NumPy version of _saturate_loop"""
+    np.copyto(out[:count], np.clip(acc[:count], -32768.0, 32767.0), casting='unsafe')
+
+
+def _compile(func, fallback):
+    """JIT-compile a kernel with Numba, falling back to `fallback` if that fails"""
+    if njit is None:
+        return fallback
+    try:
+        return njit(cache=True, fastmath=True)(func)
+    except Exception:
+        pass  # e.g. no cache locator in a frozen (PyInstaller) build
+    try:
+        return njit(cache=False, fastmath=True)(func)
+    except Exception:
+        return fallback
+
+
+_accumulate = _compile(_accumulate_loop, _accumulate_numpy)
+_saturate = _compile(_saturate_loop, _saturate_numpy)
+
+
+def mix_block(out, acc, voices):
+    """Mix one block of active voices into `out` (int16, shape (n, 2))
+
+    `voices` is a list of [data, position] entries (int16 stereo); positions are
+    advanced in place. `acc` is a float32 scratch buffer shaped like `out`.
+    Returns (frames written, list of voices that still have audio left).
+    """
+    block_frames = out.shape[0]
+    acc[:] = 0.0
+    frames = 0
+    remaining = []
+    for voice in voices:
+        data, position = voice
+        count = min(block_frames, data.shape[0] - position)
+        _accumulate(acc, data, position, count)
+        frames = max(frames, count)
+        voice[1] = position + count
+        if voice[1] < data.shape[0]:
+            remaining.append(voice)
+    _saturate(acc, out, frames)
+    return frames, remaining
+
+
+def warmup_mixer(block_frames=2048):
+    """Run a dummy mix so JIT compilation happens before the first real play"""
+    out = np.empty((block_frames, 2), dtype=np.int16)
+    acc = np.empty((block_frames, 2), dtype=np.float32)
+    writable = np.zeros((block_frames, 2), dtype=np.int16)
+    # Memory-mapped mirrors are read-only, which Numba types separately
+    readonly = np.zeros((block_frames, 2), dtype=np.int16)
+    readonly.setflags(write=False)
+    voices = [[writable, 0], [readonly, 0]]
+    mix_block(out, acc, voices)
@@ -0,0 +1,67 @@
+"""
+Tests for the audio block mixer (NumPy kernels)
+"""
+
+import numpy as np
+import pytest
+
+import audio_manager_mix
+
+
+@pytest.fixture(autouse=True)
+def numpy_kernels(monkeypatch):
+    """Run mix_block against the NumPy kernels regardless of Numba"""
+    monkeypatch.setattr(audio_manager_mix, '_accumulate', audio_manager_mix._accumulate_numpy)
+    monkeypatch.setattr(audio_manager_mix, '_saturate', audio_manager_mix._saturate_numpy)
+
+
+def _buffers(block_frames):
+    out = np.zeros((block_frames, 2), dtype=np.int16)
+    acc = np.zeros((block_frames, 2), dtype=np.float32)
+    return out, acc
+
+
+def _clip(frames, value):
+    return np.full((frames, 2), value, dtype=np.int16)
+
+
+def test_overlapping_full_scale_voices_saturate():
+    out, acc = _buffers(8)
+    voices = [[_clip(8, 32767), 0], [_clip(8, 32767), 0]]
+    frames, _ = audio_manager_mix.mix_block(out, acc, voices)
+    assert frames == 8
+    assert (out == 32767).all()
+
+    voices = [[_clip(8, -32768), 0], [_clip(8, -32768), 0]]
+    audio_manager_mix.mix_block(out, acc, voices)
+    assert (out == -32768).all()
+
+
+def test_shorter_voice_drops_out_and_longest_sets_frame_count():
+    out, acc = _buffers(8)
+    short, long_ = _clip(3, 100), _clip(20, 200)
+    voices = [[short, 0], [long_, 0]]
+
+    frames, voices = audio_manager_mix.mix_block(out, acc, voices)
+    assert frames == 8
+    assert (out[:3] == 300).all()
+    assert (out[3:8] == 200).all()
+    assert len(voices) == 1 and voices[0][0] is long_ and voices[0][1] == 8
+
+    frames, voices = audio_manager_mix.mix_block(out, acc, voices)
+    assert frames == 8 and voices[0][1] == 16
+
+    frames, voices = audio_manager_mix.mix_block(out, acc, voices)
+    assert frames == 4
+    assert (out[:4] == 200).all()
+    assert voices == []
+
+
+def test_read_only_sources_are_mixed():
+    out, acc = _buffers(4)
+    source = _clip(4, -50)
+    source.setflags(write=False)
+    frames, voices = audio_manager_mix.mix_block(out, acc, [[source, 0]])
+    assert frames == 4
+    assert (out == -50).all()
+    assert voices == []